@@ -1,7 +1,38 @@
-from collections import namedtuple
-from typing import Any, Callable
+from collections import deque, namedtuple
+from functools import lru_cache
+from inspect import isawaitable
+from typing import Any, Callable, Iterable, Iterator
 
-from state import Context, State, StateInterlayer
+from state import (
+    FALSE_CONDITION,
+    TRUE_CONDITION,
+    Context,
+    SimpleStateContainer,
+    State,
+    StateInterlayer,
+)
+
+
+def _walk(table, state_id, ctx_ids):
+    for i in range(len(ctx_ids)):
+        state_id = table[state_id, ctx_ids[i]]
+        if state_id < 0:
+            # encodes position of the missing transition
+            return -1 - i
+    return state_id
+
+
+_compiled_walk = None
+
+
+def _make_next(
+    getcontext: Callable[..., Context], row: dict[Context, State]
+) -> Callable[..., tuple[Context, State]]:
+    def _next(*args, **kwargs):
+        context = getcontext(*args, **kwargs)
+        return context, row[context]
+
+    return _next
 
 
 class FSM:
@@ -15,28 +46,126 @@ class FSM:
         name,
         transitions: dict[str, dict[Context, str]] | None,
         states: list | None,
+        cache_transitions: bool = False,
     ) -> None:
         '''
         Args:
             name (str): name of the state.
             transitions (dict[str, dict[Context, str]]): table of transitions where key is name of state.
+            cache_transitions (bool): memoize getnextstate results,
+                requires stable Context.__hash__.
         '''
         self.name = name
         self.states = {}
         if states is not None:
             self.states = {state.name: state for state in states}
 
-        self.transitions = {}
-        if transitions is not None:
-            if set(self.transitions).issubset(set(self.states)):
-                self.transitions = transitions
-            else:
-                raise Exception(
+        self._state_names = frozenset(self.states)
+        if transitions:
+            referenced = set(transitions)
+            for row in transitions.values():
+                referenced.update(row.values())
+            if not referenced.issubset(self._state_names):
+                raise ValueError(
                     "list of states in transitions table must be subset of states list"
                 )
+        self.transitions = transitions or {}
+
+        # transitions with destination names resolved to State objects
+        self._trans = {
+            src: {ctx: self.states[dst] for ctx, dst in row.items()}
+            for src, row in self.transitions.items()
+        }
+        self._all_contexts = {c for row in self.transitions.values() for c in row}
+        # state -> fused getcontext and transition, set by finalize
+        self.fused: dict[State, Callable[..., tuple[Context, State]]] | None = None
+
+        # numeric representation, built by compile
+        self.state_ids: dict[str, int] | None = None
+        self.context_ids: dict[Context, int] | None = None
+        self.table = None
+
+        self.cache_transitions = cache_transitions
+        if cache_transitions:
+            self.getnextstate = lru_cache(maxsize=4096)(self.getnextstate)
 
     def getnextstate(self, state: str, context: Context) -> State:
-        return self.states[self.transitions[state][context]]
+        return self._trans[state][context]
+
+    def compile(self) -> bool:
+        '''Builds a numeric transition table for stepping batches with walk().
+
+        States and contexts are interned to ints (state_ids, context_ids) and
+        the table is int32 array of shape (states, contexts) with -1 for
+        missing transitions. Single events keep using getnextstate, since a
+        Numba call per event costs more than the dict lookup.
+        Does nothing if numpy or numba are not installed.
+
+        Returns:
+            True if the table is built and walk can be used.
+        '''
+        global _compiled_walk
+        try:
+            import numpy as np
+            from numba import njit
+        except ImportError:
+            return False
+
+        if _compiled_walk is None:
+            _compiled_walk = njit(cache=True)(_walk)
+
+        self.state_ids = {name: i for i, name in enumerate(self.states)}
+        self.context_ids = {ctx: i for i, ctx in enumerate(self._all_contexts)}
+        self.table = np.full(
+            (len(self.state_ids), len(self.context_ids)), -1, dtype=np.int32
+        )
+        for src, row in self.transitions.items():
+            for ctx, dst in row.items():
+                self.table[self.state_ids[src], self.context_ids[ctx]] = (
+                    self.state_ids[dst]
+                )
+        self._state_list = list(self.states.values())
+        return True
+
+    def walk(self, state: str, contexts: Iterable[Context]) -> State:
+        '''Steps through all contexts in one call of the compiled kernel.
+
+        Only the transition table is used: no actions, conditions or history.
+
+        Args:
+            state (str): name of the start state.
+            contexts (Iterable[Context]): contexts of consecutive transitions.
+
+        Returns:
+            State reached after the last context.
+        '''
+        import numpy as np
+
+        if self.table is None:
+            raise RuntimeError("FSM.compile() must succeed before walk()")
+
+        context_ids = self.context_ids
+        ctx_ids = np.fromiter((context_ids[c] for c in contexts), dtype=np.int32)
+        state_id = _compiled_walk(self.table, self.state_ids[state], ctx_ids)
+        if state_id < 0:
+            raise KeyError(f"no transition for context #{-1 - state_id}")
+        return self._state_list[state_id]
+
+    def finalize(self) -> None:
+        '''Fuses getcontext and getnextstate of every state into one call.
+
+        Each state gets a closure that returns the context and the next state,
+        kept on this FSM and used by FSMHandler.handle instead of getnextstate,
+        so states may be shared with other machines.
+
+        Fused transitions bypass getnextstate: for a finalized FSM handle
+        ignores cache_transitions (getcontext caching of the states still
+        applies). async_handle always uses getnextstate.
+        '''
+        self.fused = {
+            state: _make_next(state.getcontext, self._trans.get(name, {}))
+            for name, state in self.states.items()
+        }
 
     def __getitem__(self, name) -> State:
         '''
@@ -49,61 +178,74 @@ class FSM:
         return self.states[name]
 
     def isstate(self, name) -> bool:
-        return name in self.states
+        return name in self._state_names
 
 
 Record = namedtuple("Record", ["context", "state"])
 
 
-class FSMHistory(list[Record]):
+class FSMHistory:
     def __init__(self, machine: FSM, size: int = None) -> None:
         self.machine = machine
         self.size = size
-        super().__init__()
+        self._buf: deque[Record] = deque(maxlen=size)
+        self._state_seq_parts: deque[str] = deque(maxlen=size)
+        self._ctx_seq_parts: deque[str] = deque(maxlen=size)
 
     def append(self, context: Context, state: State) -> None:
-        if not self.machine.isstate(state.name):
+        if state.name not in self.machine._state_names:
             raise Exception()
 
-        if not any(context in x for x in self.machine.transitions.values()):
+        if context not in self.machine._all_contexts:
             raise Exception()
 
-        super().append(Record(context, state))
-        if self.size is not None and len(self) > self.size:
-            super().pop(0)
+        self._buf.append(Record(context, state))
+        self._state_seq_parts.append(state.name)
+        self._ctx_seq_parts.append(str(context))
 
     def show(self) -> None:
-        from tabulate import tabulate
-
-        print(
-            tabulate(
-                map(
-                    lambda el: (el[0], el[1].context, el[1].state.name), enumerate(self)
-                ),
-                headers=["id", "Context", "State"],
-                tablefmt="pipe",
-            )
+        header = ("id", "Context", "State")
+        rows = [
+            (str(i), str(record.context), record.state.name)
+            for i, record in enumerate(self._buf)
+        ]
+        widths = [
+            max((len(row[col]) for row in rows), default=0) for col in range(3)
+        ]
+        widths = [max(w, len(h)) for w, h in zip(widths, header)]
+
+        lines = [
+            "| " + " | ".join(h.ljust(w) for h, w in zip(header, widths)) + " |",
+            "|" + "|".join("-" * (w + 2) for w in widths) + "|",
+        ]
+        lines.extend(
+            "| " + " | ".join(v.ljust(w) for v, w in zip(row, widths)) + " |"
+            for row in rows
         )
+        print("\n".join(lines))
 
     def get_state_sequence(self, sep: str = "") -> str:
-        return sep.join(el.state.name for el in self)
+        return sep.join(self._state_seq_parts)
 
     def get_context_sequence(self, sep: str = "") -> str:
-        return sep.join(el.context for el in self)
+        return sep.join(self._ctx_seq_parts)
 
-    def __getattr__(self, name):
-        if hasattr(super(), name):
-            original_method = getattr(super(), name)
-            if callable(original_method):
+    def __getitem__(self, index: int) -> Record:
+        return self._buf[index]
 
-                def wrapper(*args, **kwargs):
-                    result = original_method(*args, **kwargs)
-                    return result
+    def __len__(self) -> int:
+        return len(self._buf)
 
-                return wrapper
-        raise AttributeError(
-            f"'{type(self).__name__}' object has no attribute '{name}'"
-        )
+    def __iter__(self) -> Iterator[Record]:
+        return iter(self._buf)
+
+    def __reversed__(self) -> Iterator[Record]:
+        return reversed(self._buf)
+
+    def clear(self) -> None:
+        self._buf.clear()
+        self._state_seq_parts.clear()
+        self._ctx_seq_parts.clear()
 
 
 class FSMHandler:
@@ -113,44 +255,101 @@ class FSMHandler:
         self.interlayer = interlayer
         self.machine = machine
         self.history = history
+        # SimpleStateContainer ignores handler arguments, so its state
+        # is read and written directly instead of through method calls
+        self._container = (
+            interlayer if type(interlayer) is SimpleStateContainer else None
+        )
 
     def handle(self, *args, **kwargs) -> Any | None:
-        cur_state = self.interlayer.get_state(*args, **kwargs)
-        if not cur_state.entering_condition(*args, **kwargs):
+        history = self.history
+        container = self._container
+        if container is not None:
+            cur_state = container.state
+        else:
+            cur_state = self.interlayer.get_state(*args, **kwargs)
+        ec = cur_state.entering_condition
+        if ec is FALSE_CONDITION:
+            return
+        if ec is not TRUE_CONDITION and not ec(*args, **kwargs):
             return
 
         res = cur_state.action(*args, **kwargs)
-        if not cur_state.transition_condition(*args, **kwargs):
-            if self.history is not None:
-                self.history.append(None, None)
+        tc = cur_state.transition_condition
+        if tc is FALSE_CONDITION or (
+            tc is not TRUE_CONDITION and not tc(*args, **kwargs)
+        ):
+            if history is not None:
+                history.append(None, None)
             return res
 
-        context = cur_state.getcontext(*args, **kwargs)
-        new_state = self.machine.getnextstate(cur_state.name, context)
-        self.interlayer.set_state(new_state)
-
-        if self.history is not None:
-            self.history.append(context, new_state)
+        fused = self.machine.fused
+        if fused is not None:
+            context, new_state = fused[cur_state](*args, **kwargs)
+        else:
+            context = cur_state.getcontext(*args, **kwargs)
+            new_state = self.machine.getnextstate(cur_state.name, context)
+        if container is not None:
+            container.state = new_state
+        else:
+            self.interlayer.set_state(new_state)
+
+        if history is not None:
+            history.append(context, new_state)
         return res
 
     async def async_handle(self, *args, **kwargs) -> Any:
-        cur_state: State = await self.interlayer.get_state(*args, **kwargs)
-
-        if not await cur_state.entering_condition(*args, **kwargs):
+        '''
+        Same as handle, but awaits results of the interlayer and state
+        callables that return awaitables; synchronous ones are called directly.
+        '''
+        history = self.history
+        container = self._container
+        if container is not None:
+            cur_state = container.state
+        else:
+            cur_state: State = self.interlayer.get_state(*args, **kwargs)
+            if isawaitable(cur_state):
+                cur_state = await cur_state
+
+        ec = cur_state.entering_condition
+        if ec is FALSE_CONDITION:
             return
+        if ec is not TRUE_CONDITION:
+            entered = ec(*args, **kwargs)
+            if isawaitable(entered):
+                entered = await entered
+            if not entered:
+                return
 
-        res = await cur_state.action(*args, **kwargs)
-        if not await cur_state.transition_condition(*args, **kwargs):
-            if self.history is not None:
-                self.history.append(None, None)
+        res = cur_state.action(*args, **kwargs)
+        if isawaitable(res):
+            res = await res
+
+        tc = cur_state.transition_condition
+        transit = tc is TRUE_CONDITION
+        if not transit and tc is not FALSE_CONDITION:
+            transit = tc(*args, **kwargs)
+            if isawaitable(transit):
+                transit = await transit
+        if not transit:
+            if history is not None:
+                history.append(None, None)
             return res
 
-        context = await cur_state.getcontext(*args, **kwargs)
+        context = cur_state.getcontext(*args, **kwargs)
+        if isawaitable(context):
+            context = await context
         new_state = self.machine.getnextstate(cur_state.name, context)
-        await self.interlayer.set_state(new_state)
-
-        if self.history is not None:
-            self.history.append(context, new_state)
+        if container is not None:
+            container.state = new_state
+        else:
+            done = self.interlayer.set_state(new_state)
+            if isawaitable(done):
+                await done
+
+        if history is not None:
+            history.append(context, new_state)
         return res
 
 
@@ -162,21 +361,18 @@ class FinalStetesFSM(FSM):
         states: list | None,
         final_states: list | None,
         final_state_callback: Callable[[State, Context, Any], Any],
+        cache_transitions: bool = False,
     ) -> None:
-        super().__init__(name, transitions, states)
+        super().__init__(name, transitions, states, cache_transitions)
 
         self.final_states = {}
         if final_states is not None:
-            if set(self.final_states).issubset(set(self.states)):
-                self.transitions = transitions
-            else:
-                raise Exception(
-                    "list of states in transitions table must be subset of states list"
-                )
             self.final_states = {state.name: state for state in final_states}
+            if not self._state_names.issuperset(self.final_states):
+                raise ValueError("list of final states must be subset of states list")
         self.final_state_callback = final_state_callback
 
-    def isfinalstate(self, name) -> State:
+    def isfinalstate(self, name) -> bool:
         return name in self.final_states
 
 
@@ -210,7 +406,9 @@ class FinalStetesFSMHandler(FSMHandler):
         if not self.machine.isfinalstate(record.state.name):
             return res
 
-        cbk_res = await self.machine.final_state_callback(
+        cbk_res = self.machine.final_state_callback(
             record.context, record.state, *args, **kwargs
         )
+        if isawaitable(cbk_res):
+            cbk_res = await cbk_res
         return cbk_res, res
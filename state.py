@@ -1,20 +1,82 @@
-from abc import abstractmethod
+from functools import lru_cache
+from inspect import iscoroutinefunction
+from types import MemberDescriptorType
 from typing import Any, Callable, Protocol
 
 from tools import constant
 
 
 class Context(Protocol):
-    @abstractmethod
     def __hash__(self) -> int:
         pass
 
 
+def cache_hash(cls: type) -> type:
+    '''
+    Class decorator for immutable contexts: hash of each instance is computed
+    once and then returned from the instance. Instances must be able to store
+    the _cached_hash attribute (have a __dict__ or a _cached_hash slot).
+
+    The cached hash is left out of __getstate__, so pickled or copied instances
+    recompute it; str hashes differ between processes. Classes with their own
+    __reduce__ bypass __getstate__ and must not carry the hash across processes.
+
+    Raises:
+        TypeError: if the class is unhashable or cannot store the hash.
+    '''
+    compute = cls.__hash__
+    if compute is None:
+        raise TypeError(f"{cls.__qualname__} is unhashable")
+    has_slot = isinstance(
+        getattr(cls, "_cached_hash", None), MemberDescriptorType
+    )
+    if not cls.__dictoffset__ and not has_slot:
+        raise TypeError(
+            f"{cls.__qualname__} instances cannot store the _cached_hash attribute"
+        )
+
+    def __hash__(self) -> int:
+        try:
+            return self._cached_hash
+        except AttributeError:
+            h = compute(self)
+            object.__setattr__(self, "_cached_hash", h)
+            return h
+
+    getstate = cls.__getstate__
+
+    def __getstate__(self):
+        state = getstate(self)
+        if isinstance(state, tuple):
+            # (__dict__ state, slots state)
+            return tuple(_drop_cached_hash(part) for part in state)
+        return _drop_cached_hash(state)
+
+    cls.__hash__ = __hash__
+    cls.__getstate__ = __getstate__
+    return cls
+
+
+def _drop_cached_hash(state: Any) -> Any:
+    if isinstance(state, dict) and "_cached_hash" in state:
+        return {k: v for k, v in state.items() if k != "_cached_hash"}
+    return state
+
+
 TRUE_CONDITION = constant(True)  # noqa: E731
 FALSE_CONDITION = constant(False)  # noqa: E731
+_BOOL_COND = (FALSE_CONDITION, TRUE_CONDITION)
 
 
 class State:
+    __slots__ = (
+        "name",
+        "action",
+        "getcontext",
+        "entering_condition",
+        "transition_condition",
+    )
+
     def __init__(
         self,
         name: str,
@@ -22,6 +84,7 @@ class State:
         getcontext: Callable[[Any], Context],
         entering_condition: Callable[[Any], bool] | bool,
         transition_condition: Callable[[Any], bool] | bool,
+        cache_context: bool = False,
     ) -> None:
         '''
         Args:
@@ -30,24 +93,28 @@ class State:
             getcontext (Callable[[Any], Context]): must return context of tranition to the next state.
             entering_condition (Callable[[Any], bool]): condition of entering in state.
             transition_condition (Callable[[Any], bool]): condition of transition to other state.
+            cache_context (bool): memoize getcontext, it must be a pure function of hashable arguments.
+                Not supported for coroutine functions.
         '''
+        if cache_context and iscoroutinefunction(getcontext):
+            raise ValueError("cache_context is not supported for coroutine getcontext")
+
         self.name = name
         self.action = action
-        self.getcontext = getcontext
-
-        if type(entering_condition) is not bool:
-            self.entering_condition = entering_condition
-        elif entering_condition:
-            self.entering_condition = TRUE_CONDITION
-        else:
-            self.entering_condition = FALSE_CONDITION
-
-        if type(entering_condition) is not bool:
-            self.transition_condition = transition_condition
-        elif entering_condition:
-            self.transition_condition = TRUE_CONDITION
-        else:
-            self.transition_condition = FALSE_CONDITION
+        self.getcontext = (
+            lru_cache(maxsize=1024)(getcontext) if cache_context else getcontext
+        )
+
+        self.entering_condition = (
+            _BOOL_COND[entering_condition]
+            if isinstance(entering_condition, bool)
+            else entering_condition
+        )
+        self.transition_condition = (
+            _BOOL_COND[transition_condition]
+            if isinstance(transition_condition, bool)
+            else transition_condition
+        )
 
 
 class StateInterlayer(Protocol):
@@ -64,6 +131,8 @@ class SimpleStateContainer:
     '''
     Save last state.
     '''
+    __slots__ = ("state",)
+
     def __init__(self, start_state: State):
         self.state = start_state
 
@@ -1,10 +1,13 @@
 import logging
-import sys
+
+_log = logging.getLogger(__name__)
 
 
 def pipeline(middlewares: list):
+    pairs = tuple(middlewares)
+
     async def wrapper(*args, **kwargs):
-        for check, handler in middlewares:
+        for check, handler in pairs:
             if check(*args, **kwargs):
                 await handler(*args, **kwargs)
 
@@ -22,20 +25,24 @@ def counter(func, num, action_func=None):
     cnt = 0
 
     async def wrapper(*args, **kwargs):
-        nonlocal cnt, num
-        cnt += 1
-        if cnt >= num:
-            return await action_func(*args, **kwargs) if action_func else None
-        return await func(*args, **kwargs)
+        nonlocal cnt
+        # the count stops once the threshold is reached
+        if cnt < num:
+            cnt += 1
+            if cnt < num:
+                return await func(*args, **kwargs)
+        return await action_func(*args, **kwargs) if action_func else None
 
     return wrapper
 
 
 def catch_exception(func):
+    qualname = func.__qualname__
+
     async def wrapper(*args):
         try:
             return await func(*args)
         except BaseException:
-            logging.warning(msg=f"{func.__qualname__} {sys.exc_info()[:2]}")
+            _log.warning("%s failed", qualname, exc_info=True)
 
     return wrapper